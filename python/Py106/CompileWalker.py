@@ -0,0 +1,30 @@
+'''
+CompileWalker - Ahead of time compile the packet header walk used by
+Packet.IO.scan_all_headers()
+
+The header walk is normally compiled by numba the first time it is used,
+which can take longer than scanning a small file.  Running this module
+builds the py106_walker extension module next to Packet.py.  When it is
+present Packet uses it directly, without compiling anything and without
+needing numba installed.  Numba is only needed to run this module.
+
+    python -m Py106.CompileWalker
+
+'''
+
+import os.path
+
+from numba.pycc import CC
+
+import Py106.Packet as Packet
+
+
+cc = CC("py106_walker")
+cc.output_dir = os.path.dirname(os.path.abspath(__file__))
+
+cc.export("walk_headers", "Tuple((i8[::1], i8))(u1[::1], i8, i8)")(
+    Packet._walk_headers_nb)
+
+
+if __name__ == "__main__":
+    cc.compile()
@@ -9,15 +9,30 @@ this is that to use data first the data buffer needs to be cast to the
 appropriate data structure.  Then the fields are accessed using the '.contents'
 attribute.
 
+Bulk header scanning returns numpy arrays and is only available when numpy is
+installed.  If numba is also installed it is used to speed up file scanning,
+see also CompileWalker.py.
+
 '''
 
 import os.path
 import sys
 import platform
 import ctypes
+import collections
+import mmap
+import queue
+import struct
+import threading
+import warnings
 #import datetime
 import Py106.Status as Status
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 # ---------------------------------------------------------------------------
 # IRIG 106 data structures
@@ -40,6 +55,10 @@ class Header(ctypes.Structure):
                 ("Reserved",        ctypes.c_uint16),
                 ("SecChecksum",     ctypes.c_uint16)]
 
+# Numpy version of Header, used for arrays of headers
+if numpy is not None:
+    HeaderDType = numpy.dtype(Header).newbyteorder('<')
+
 # ---------------------------------------------------------------------------
 # IRIG 106 constants
 # ---------------------------------------------------------------------------
@@ -94,37 +113,51 @@ class DataType(object):
 
     @staticmethod
     def TypeName(TypeNum):
-        name = {DataType.USER_DEFINED       : "User Defined",
-                DataType.TMATS              : "TMATS",
-                DataType.RECORDING_EVENT    : "Event",
-                DataType.RECORDING_INDEX    : "Index",
-                DataType.COMPUTER_4         : "Computer Generated 4",
-                DataType.COMPUTER_5         : "Computer Generated 5",
-                DataType.COMPUTER_6         : "Computer Generated 6",
-                DataType.COMPUTER_7         : "Computer Generated 7",
-                DataType.PCM_FMT_0          : "PCM Format 0",
-                DataType.PCM_FMT_1          : "PCM Format 1",
-                DataType.IRIG_TIME          : "Time",
-                DataType.MIL1553_FMT_1      : "1553",
-                DataType.MIL1553_16PP194    : "16PP194",
-                DataType.ANALOG             : "Analog",
-                DataType.DISCRETE           : "Discrete",
-                DataType.MESSAGE            : "Message",
-                DataType.ARINC_429_FMT_0    : "ARINC 429",
-                DataType.VIDEO_FMT_0        : "Video Format 0",
-                DataType.VIDEO_FMT_1        : "Video Format 1",
-                DataType.VIDEO_FMT_2        : "Video Format 2",
-                DataType.IMAGE_FMT_0        : "Image Format 0",
-                DataType.IMAGE_FMT_1        : "Image Format 1",
-                DataType.UART_FMT_0         : "UART",
-                DataType.IEEE1394_FMT_0     : "IEEE 1394 Format 0",
-                DataType.IEEE1394_FMT_1     : "IEEE 1394 Format 1",
-                DataType.PARALLEL_FMT_0     : "Parallel",
-                DataType.ETHERNET_FMT_0     : "Ethernet",
-                DataType.CAN_BUS            : "CAN Bus",
-                DataType.FIBRE_CHAN_FMT_0   : "Fibre Channel Format 0",
-                DataType.FIBRE_CHAN_FMT_1   : "Fibre Channel Format 1"}
-        return name.get(TypeNum, "Undefined")
+        if 0 <= TypeNum < 256:
+            return _TypeNames[TypeNum]
+        return "Undefined"
+
+    @staticmethod
+    def TypeNameArray(TypeNums):
+        ''' Names for a numpy array of data type numbers, as an array '''
+        return _TypeNameArray[TypeNums]
+
+
+# Data type names, indexed by data type number
+_TypeNames = ["Undefined"] * 256
+_TypeNames[DataType.USER_DEFINED]     = "User Defined"
+_TypeNames[DataType.TMATS]            = "TMATS"
+_TypeNames[DataType.RECORDING_EVENT]  = "Event"
+_TypeNames[DataType.RECORDING_INDEX]  = "Index"
+_TypeNames[DataType.COMPUTER_4]       = "Computer Generated 4"
+_TypeNames[DataType.COMPUTER_5]       = "Computer Generated 5"
+_TypeNames[DataType.COMPUTER_6]       = "Computer Generated 6"
+_TypeNames[DataType.COMPUTER_7]       = "Computer Generated 7"
+_TypeNames[DataType.PCM_FMT_0]        = "PCM Format 0"
+_TypeNames[DataType.PCM_FMT_1]        = "PCM Format 1"
+_TypeNames[DataType.IRIG_TIME]        = "Time"
+_TypeNames[DataType.MIL1553_FMT_1]    = "1553"
+_TypeNames[DataType.MIL1553_16PP194]  = "16PP194"
+_TypeNames[DataType.ANALOG]           = "Analog"
+_TypeNames[DataType.DISCRETE]         = "Discrete"
+_TypeNames[DataType.MESSAGE]          = "Message"
+_TypeNames[DataType.ARINC_429_FMT_0]  = "ARINC 429"
+_TypeNames[DataType.VIDEO_FMT_0]      = "Video Format 0"
+_TypeNames[DataType.VIDEO_FMT_1]      = "Video Format 1"
+_TypeNames[DataType.VIDEO_FMT_2]      = "Video Format 2"
+_TypeNames[DataType.IMAGE_FMT_0]      = "Image Format 0"
+_TypeNames[DataType.IMAGE_FMT_1]      = "Image Format 1"
+_TypeNames[DataType.UART_FMT_0]       = "UART"
+_TypeNames[DataType.IEEE1394_FMT_0]   = "IEEE 1394 Format 0"
+_TypeNames[DataType.IEEE1394_FMT_1]   = "IEEE 1394 Format 1"
+_TypeNames[DataType.PARALLEL_FMT_0]   = "Parallel"
+_TypeNames[DataType.ETHERNET_FMT_0]   = "Ethernet"
+_TypeNames[DataType.CAN_BUS]          = "CAN Bus"
+_TypeNames[DataType.FIBRE_CHAN_FMT_0] = "Fibre Channel Format 0"
+_TypeNames[DataType.FIBRE_CHAN_FMT_1] = "Fibre Channel Format 1"
+
+if numpy is not None:
+    _TypeNameArray = numpy.array(_TypeNames, dtype=object)
 
 
 # ---------------------------------------------------------------------------
@@ -155,17 +188,44 @@ def I106_Ch10ReadNextHeader(handle, pkt_header):
     ''' Read next packet header '''
     # handle - IRIG file handle
     # pkt_header - Py106 Header() class, mutable
-    ret_status = IrigDataDll.enI106Ch10ReadNextHeader(handle,
-                                                      ctypes.byref(pkt_header))
+    ret_status = IrigDataDll.enI106Ch10ReadNextHeader(handle, pkt_header)
     return ret_status
 
 
+def I106_Ch10ScanHeaders(handle, ch_ids, data_types, max_hdrs):
+    ''' Read a batch of packet headers, keeping channel ID and data type '''
+    # handle - IRIG file handle
+    # ch_ids - Numpy uint16 array, mutable
+    # data_types - Numpy uint8 array, mutable
+    # max_hdrs - Maximum number of headers to read, at most the array length
+    # Returns (status of last read, number of headers read)
+    hdr_cnt = ctypes.c_ulong(0)
+    ret_status = IrigDataDll.enI106Ch10ScanHeaders(
+        handle,
+        ch_ids.ctypes.data_as(ctypes.POINTER(ctypes.c_uint16)),
+        data_types.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8)),
+        max_hdrs, ctypes.byref(hdr_cnt))
+    return (ret_status, hdr_cnt.value)
+
+
+def I106_Ch10ReadNextHeaders(handle, pkt_headers, max_hdrs):
+    ''' Read a batch of complete packet headers '''
+    # handle - IRIG file handle
+    # pkt_headers - Numpy HeaderDType array, mutable
+    # max_hdrs - Maximum number of headers to read, at most the array length
+    # Returns (status of last read, number of headers read)
+    hdr_cnt = ctypes.c_ulong(0)
+    ret_status = IrigDataDll.enI106Ch10ReadNextHeaders(
+        handle, pkt_headers.ctypes.data_as(ctypes.POINTER(Header)),
+        max_hdrs, ctypes.byref(hdr_cnt))
+    return (ret_status, hdr_cnt.value)
+
+
 def I106_Ch10ReadPrevHeader(handle, pkt_header):
     ''' Read previous packet header '''
     # handle - IRIG file handle
     # pkt_header - Py106 class Header(), mutable
-    ret_status = IrigDataDll.enI106Ch10ReadPrevHeader(handle,
-                                                      ctypes.byref(pkt_header))
+    ret_status = IrigDataDll.enI106Ch10ReadPrevHeader(handle, pkt_header)
     return ret_status
 
 
@@ -173,8 +233,7 @@ def I106_Ch10ReadData(handle, buff_size, data_buff):
     # handle - IRIG file handle
     # buff_size - Size of data_buff
     # data_buff - Ctypes string buffer, mutable
-    ret_status = IrigDataDll.enI106Ch10ReadData(handle, buff_size,
-                                                ctypes.byref(data_buff))
+    ret_status = IrigDataDll.enI106Ch10ReadData(handle, buff_size, data_buff)
     return ret_status
 
 
@@ -199,15 +258,277 @@ def I106_Ch10SetPos(handle, offset):
 
 def I106_Ch10GetPos(handle):
     # handle - IRIG file handle
-    offset = ctypes.c_uint64(0)
+    offset = ctypes.c_int64(0)
     ret_status = IrigDataDll.enI106Ch10GetPos(handle, ctypes.byref(offset))
     return (ret_status, offset.value)
 
 
+# ---------------------------------------------------------------------------
+# Bulk header scanning
+# ---------------------------------------------------------------------------
+
+# Size of the file window walked at a time while the OS reads the next one
+_SCAN_WINDOW = 64 * 1024 * 1024
+
+# Number of packet headers copied out of the file per gather step
+_GATHER_CHUNK = 16384
+
+# _walk_headers(file_bytes, offset, stop) finds the file offset of each
+# packet in a memory mapped data file.
+#   file_bytes - Numpy uint8 array of the whole data file
+#   offset - File offset of the first packet
+#   stop - Stop at the first packet starting at or beyond this offset
+#   Returns (numpy int64 array of packet offsets, offset of the next packet).
+#   The walk stops early at the first packet without a good sync word,
+#   with a packet length too short for its header, or running past the end
+#   of the file.  Every header at the returned offsets is complete.
+#
+# _walk_headers_nb() is written for numba.  It is used precompiled from
+# py106_walker if it has been built, else compiled with numba at run time.
+# Without either _walk_headers_py() uses struct.  The choice is made by
+# _get_walk_headers() on the first scan, so that numba is only imported by
+# programs that scan files.
+
+
+def _walk_headers_nb(file_bytes, offset, stop):
+    offsets = numpy.empty(1024, dtype=numpy.int64)
+    pkt_cnt = 0
+    buff_len = file_bytes.size
+    while (offset < stop) and (offset + 24 <= buff_len):
+        sync = (numpy.int64(file_bytes[offset]) |
+                (numpy.int64(file_bytes[offset+1]) << 8))
+        pkt_len = (numpy.int64(file_bytes[offset+4])         |
+                   (numpy.int64(file_bytes[offset+5]) << 8)  |
+                   (numpy.int64(file_bytes[offset+6]) << 16) |
+                   (numpy.int64(file_bytes[offset+7]) << 24))
+        hdr_len = 36 if (file_bytes[offset+14] & 0x80) else 24
+        if ((sync != 0xEB25) or (pkt_len < hdr_len) or
+                (offset + pkt_len > buff_len)):
+            break
+        if pkt_cnt == offsets.size:
+            more_offsets = numpy.empty(2 * offsets.size, dtype=numpy.int64)
+            more_offsets[:pkt_cnt] = offsets
+            offsets = more_offsets
+        offsets[pkt_cnt] = offset
+        pkt_cnt += 1
+        offset += pkt_len
+    return (offsets[:pkt_cnt].copy(), offset)
+
+
+def _walk_headers_py(file_bytes, offset, stop):
+    offsets = []
+    buff_len = file_bytes.size
+    while (offset < stop) and (offset + 24 <= buff_len):
+        (sync, ch_id, pkt_len) = struct.unpack_from('<HHI', file_bytes,
+                                                    offset)
+        hdr_len = 36 if (file_bytes[offset+14] & 0x80) else 24
+        if ((sync != 0xEB25) or (pkt_len < hdr_len) or
+                (offset + pkt_len > buff_len)):
+            break
+        offsets.append(offset)
+        offset += pkt_len
+    return (numpy.array(offsets, dtype=numpy.int64), offset)
+
+
+_walk_headers = None
+
+
+def _get_walk_headers():
+    ''' Fastest available _walk_headers(), picked on the first call '''
+    global _walk_headers
+    if _walk_headers is None:
+        # Ahead of time compiled header walk, built by CompileWalker.py.  If
+        # it's there numba isn't needed and importing it would only slow
+        # things down.
+        try:
+            import Py106.py106_walker as py106_walker
+            _walk_headers = py106_walker.walk_headers
+        except ImportError:
+            try:
+                import numba
+                _walk_headers = numba.njit(cache=True)(_walk_headers_nb)
+            except ImportError:
+                _walk_headers = _walk_headers_py
+    return _walk_headers
+
+
+def _channel_mask(chan_ids, ch_ids):
+    ''' Boolean mask of the chan_ids array elements found in ch_ids '''
+    # chan_ids - Numpy uint16 array of channel IDs to test
+    # ch_ids - Sequence of channel IDs to keep
+    # Uses a lookup table over all 65536 channel IDs, one pass over chan_ids
+    keep_chan = numpy.zeros(65536, dtype=numpy.bool_)
+    keep_chan[numpy.asarray(ch_ids, dtype=numpy.uint16)] = True
+    return keep_chan[chan_ids]
+
+
+def _gather_headers(file_bytes, offsets):
+    ''' Copy the packet headers at the given offsets into a Header array '''
+    # file_bytes - Numpy uint8 array of the whole data file
+    # offsets - Numpy int64 array of packet offsets from _walk_headers(),
+    #           so every header is complete
+    # Returns numpy array of HeaderDType
+    # Gathered a chunk of offsets at a time so the byte index array stays
+    # small no matter how many packets there are
+    headers = numpy.empty(offsets.size, dtype=HeaderDType)
+    hdr_bytes = headers.view(numpy.uint8).reshape(offsets.size,
+                                                  HeaderDType.itemsize)
+    hdr_steps = numpy.arange(HeaderDType.itemsize)
+    for start in range(0, offsets.size, _GATHER_CHUNK):
+        chunk_offsets = offsets[start:start + _GATHER_CHUNK]
+        hdr_idx = chunk_offsets[:, None] + hdr_steps
+        hdr_bytes[start:start + chunk_offsets.size] = file_bytes[hdr_idx]
+    # Secondary header fields only mean something if the flag is set
+    no_sec_hdr = (headers['PacketFlags'] & 0x80) == 0
+    for field in ('Time', 'Reserved', 'SecChecksum'):
+        headers[field][no_sec_hdr] = 0
+    return headers
+
+
+class HeaderArrays(object):
+    '''
+    Scanned packet headers stored as parallel numpy arrays, one element per
+    packet, so that a field of all packets is one contiguous array
+    '''
+
+    def __init__(self, Offsets, ChIDs, DataTypes, PacketLens, SeqNums,
+                 RelTimes):
+        self.Offsets    = Offsets       # int64 file offset of each packet
+        self.ChIDs      = ChIDs         # uint16
+        self.DataTypes  = DataTypes     # uint8
+        self.PacketLens = PacketLens    # uint32
+        self.SeqNums    = SeqNums       # uint8
+        self.RelTimes   = RelTimes      # uint64 48 bit relative time counter
+
+    @staticmethod
+    def from_headers(Offsets, Headers):
+        ''' Make from packet offsets and a matching HeaderDType array '''
+        RelTimes = numpy.zeros(len(Headers), dtype=numpy.uint64)
+        for ByteNum in range(6):
+            RelTimes |= (Headers['RefTime'][:, ByteNum].astype(numpy.uint64)
+                         << numpy.uint64(8 * ByteNum))
+        return HeaderArrays(Offsets.astype(numpy.int64),
+                            Headers['ChID'].copy(),
+                            Headers['DataType'].copy(),
+                            Headers['PacketLen'].copy(),
+                            Headers['SeqNum'].copy(),
+                            RelTimes)
+
+    def __len__(self):
+        return len(self.Offsets)
+
+    def time_range(self, StartTime, StopTime):
+        '''
+        Numpy array of the indexes of the packets with StartTime <= RelTimes
+        < StopTime, in file order.  Relative times are not assumed to
+        increase through the file, packets from different channels are
+        often written out of time order.
+        '''
+        return numpy.flatnonzero((self.RelTimes >= StartTime) &
+                                 (self.RelTimes < StopTime))
+
+    def save(self, FileName):
+        '''
+        Save to a compressed numpy .npz file.  Fields that are predictable
+        from packet to packet are stored as differences, channel IDs and
+        data types as indexes into a table of the values used, and then
+        everything is zlib compressed.
+        '''
+        ChIDTable, ChIDIdx = _dict_encode(self.ChIDs)
+        DataTypeTable, DataTypeIdx = _dict_encode(self.DataTypes)
+        # Offsets as the gap after the previous packet, normally 0
+        OffsetGaps = numpy.zeros(len(self), dtype=numpy.int64)
+        OffsetGaps[1:] = (self.Offsets[1:] - self.Offsets[:-1] -
+                          self.PacketLens[:-1])
+        FirstOffset = self.Offsets[:1]
+        with open(FileName, 'wb') as IndexFile:
+            numpy.savez_compressed(
+                IndexFile, Version=numpy.array(1),
+                FirstOffset=FirstOffset, OffsetGaps=OffsetGaps,
+                ChIDTable=ChIDTable, ChIDIdx=ChIDIdx,
+                DataTypeTable=DataTypeTable, DataTypeIdx=DataTypeIdx,
+                PacketLens=self.PacketLens,
+                SeqNumDeltas=_channel_deltas(self.SeqNums, ChIDIdx),
+                RelTimeDeltas=numpy.diff(self.RelTimes.astype(numpy.int64),
+                                         prepend=0))
+
+    @staticmethod
+    def load(FileName):
+        ''' Load from a file written by save() '''
+        with numpy.load(FileName) as Index:
+            if int(Index['Version']) != 1:
+                raise ValueError("Unsupported header index version %d" %
+                                 int(Index['Version']))
+            PacketLens = Index['PacketLens']
+            ChIDIdx = Index['ChIDIdx']
+            # Packet N+1 starts after packet N plus any gap
+            Offsets = numpy.zeros(len(PacketLens), dtype=numpy.int64)
+            if len(Offsets) > 0:
+                Offsets[0] = Index['FirstOffset'][0]
+                Offsets[1:] = (PacketLens[:-1].astype(numpy.int64) +
+                               Index['OffsetGaps'][1:])
+                Offsets = numpy.cumsum(Offsets)
+            return HeaderArrays(
+                Offsets,
+                Index['ChIDTable'][ChIDIdx],
+                Index['DataTypeTable'][Index['DataTypeIdx']],
+                PacketLens,
+                _channel_undeltas(Index['SeqNumDeltas'], ChIDIdx),
+                numpy.cumsum(Index['RelTimeDeltas']).astype(numpy.uint64))
+
+
+def _dict_encode(values):
+    ''' Split values into a table of unique values and indexes into it '''
+    (table, index) = numpy.unique(values, return_inverse=True)
+    index_type = numpy.uint8 if len(table) <= 256 else numpy.uint16
+    return (table, index.astype(index_type))
+
+
+def _channel_groups(chan_idx):
+    ''' Stable sort order by channel and the start of each channel run '''
+    order = numpy.argsort(chan_idx, kind='stable')
+    sorted_idx = chan_idx[order]
+    group_start = numpy.ones(len(order), dtype=numpy.bool_)
+    group_start[1:] = sorted_idx[1:] != sorted_idx[:-1]
+    return (order, group_start)
+
+
+def _channel_deltas(seq_nums, chan_idx):
+    ''' Sequence numbers as steps from the previous one on the channel '''
+    # seq_nums - Numpy uint8 array of sequence numbers
+    # chan_idx - Numpy array of channel numbers, e.g. from _dict_encode()
+    # Steps are modulo 256 and normally 1. The first packet of each channel
+    # keeps its sequence number.
+    (order, group_start) = _channel_groups(chan_idx)
+    sorted_seq = seq_nums[order]
+    sorted_deltas = sorted_seq.copy()
+    sorted_deltas[1:] -= sorted_seq[:-1]
+    sorted_deltas[group_start] = sorted_seq[group_start]
+    deltas = numpy.empty_like(sorted_deltas)
+    deltas[order] = sorted_deltas
+    return deltas
+
+
+def _channel_undeltas(deltas, chan_idx):
+    ''' Inverse of _channel_deltas() '''
+    (order, group_start) = _channel_groups(chan_idx)
+    sorted_deltas = deltas[order].astype(numpy.int64)
+    sums = numpy.cumsum(sorted_deltas)
+    group_base = (sums - sorted_deltas)[group_start]
+    group_num = numpy.cumsum(group_start) - 1
+    seq_nums = numpy.empty(len(deltas), dtype=numpy.uint8)
+    seq_nums[order] = (sums - group_base[group_num]) & 0xFF
+    return seq_nums
+
+
 # ---------------------------------------------------------------------------
 # IRIG IO class
 # ---------------------------------------------------------------------------
 
+# Maximum number of headers kept by IO.header_at()
+_HEADER_CACHE_SIZE = 65536
+
+
 class IO(object):
     '''
     IRIG 106 packet data input / output
@@ -217,20 +538,28 @@ class IO(object):
     # -----------
 
     def __init__(self):
-        self._Handle = ctypes.c_uint32(-1)
+        self._Handle = ctypes.c_int32(-1)
+        self._Filename = None
         self.Header = Header()
         self.Buffer = ctypes.create_string_buffer(0)
+        self._HeaderCache = collections.OrderedDict()
+        self.ScannedHeaders = None
+        self.ScanEndOffset = None
 
     # Open and close
     # --------------
     def open(self, Filename, FileMode):
         ''' Open an IRIG file for reading or writing '''
         RetStatus, self._Handle = I106_Ch10Open(Filename, FileMode)
+        self._Filename = Filename if RetStatus == Status.OK else None
+        self._HeaderCache.clear()
         return RetStatus
 
     def close(self):
         ''' Close an open IRIG file '''
         RetStatus = I106_Ch10Close(self._Handle)
+        self._Filename = None
+        self._HeaderCache.clear()
         return RetStatus
 
     # Read / Write
@@ -243,20 +572,335 @@ class IO(object):
         RetStatus = I106_Ch10ReadPrevHeader(self._Handle, self.Header)
         return RetStatus
 
+    def read_headers(self, max_hdrs):
+        '''
+        Read up to max_hdrs next packet headers into a numpy array of
+        HeaderDType.  The headers are read through the DLL, so this works
+        for any file mode, and the read position is left after the last
+        header read.  Secondary header fields are zero for packets without
+        a secondary header.
+        Returns (status of last read, Header array)
+        '''
+        Headers = numpy.zeros(max_hdrs, dtype=HeaderDType)
+        if hasattr(IrigDataDll, "enI106Ch10ReadNextHeaders"):
+            RetStatus, HdrCnt = I106_Ch10ReadNextHeaders(self._Handle,
+                                                         Headers, max_hdrs)
+        else:
+            # Read straight into the array through a ctypes view of it
+            HeaderArray = (Header * max_hdrs).from_buffer(Headers)
+            HdrCnt = 0
+            RetStatus = Status.OK
+            while HdrCnt < max_hdrs:
+                RetStatus = I106_Ch10ReadNextHeader(self._Handle,
+                                                    HeaderArray[HdrCnt])
+                if RetStatus != Status.OK:
+                    break
+                if (HeaderArray[HdrCnt].PacketFlags & 0x80) == 0:
+                    ctypes.memset(ctypes.addressof(HeaderArray[HdrCnt]) + 24,
+                                  0, 12)
+                HdrCnt += 1
+            del HeaderArray
+        return (RetStatus, Headers[:HdrCnt])
+
+    def header_at(self, offset):
+        '''
+        Read the packet header at a file offset, for random access.  Headers
+        are cached by offset (least recently used are dropped first) so that
+        revisiting an offset doesn't read the file again.  The returned
+        Header is shared with the cache and shouldn't be changed.  The read
+        position afterwards is undefined; use set_pos() before reading on.
+        If no good packet header starts exactly at offset the status is
+        Status.INVALID_DATA, rather than the next header the DLL finds.
+        Returns (status, Header), Header is None unless status is OK
+        '''
+        PktHeader = self._HeaderCache.get(offset)
+        if PktHeader is not None:
+            self._HeaderCache.move_to_end(offset)
+            return (Status.OK, PktHeader)
+
+        RetStatus = self.set_pos(offset)
+        if RetStatus != Status.OK:
+            return (RetStatus, None)
+        PktHeader = Header()
+        RetStatus = I106_Ch10ReadNextHeader(self._Handle, PktHeader)
+        if RetStatus != Status.OK:
+            return (RetStatus, None)
+
+        # Check the header really was at offset and the DLL didn't have to
+        # skip ahead to find a good one
+        (RetStatus, EndOffset) = self.get_pos()
+        if RetStatus != Status.OK:
+            return (RetStatus, None)
+        HeaderLen = 36 if (PktHeader.PacketFlags & 0x80) else 24
+        if EndOffset - HeaderLen != offset:
+            return (Status.INVALID_DATA, None)
+
+        self._HeaderCache[offset] = PktHeader
+        if len(self._HeaderCache) > _HEADER_CACHE_SIZE:
+            self._HeaderCache.popitem(last=False)
+        return (Status.OK, PktHeader)
+
     def read_data(self):
+        # Grow the buffer geometrically so that a file with growing packet
+        # sizes only reallocates a few times
         if self.Header.PacketLen > self.Buffer._length_:
-            self.Buffer = ctypes.create_string_buffer(self.Header.PacketLen)
+            BuffSize = max(self.Header.PacketLen, 2 * self.Buffer._length_,
+                           4096)
+            BuffSize = (BuffSize + 4095) & ~4095
+            self.Buffer = ctypes.create_string_buffer(BuffSize)
         RetStatus = I106_Ch10ReadData(self._Handle, self.Buffer._length_,
                                       self.Buffer)
         return RetStatus
 
-    def packet_headers(self, ch_ids=()):
-        ''' Iterator of individual packet headers '''
-        RetStatus = self.read_next_header()
-        while RetStatus == Status.OK:
-            if (len(ch_ids) == 0) or (self.Header.ChID in ch_ids):
-                yield self.Header
+    def payload_view(self):
+        '''
+        Zero copy memoryview of the packet data read by read_data().  The
+        view is only valid until the next read_data(), which may replace
+        the buffer.
+        '''
+        DataBuff = (ctypes.c_ubyte * self.Header.DataLen).from_buffer(
+            self.Buffer)
+        return memoryview(DataBuff)
+
+    def payload_bytes(self):
+        '''
+        Copy of the packet data read by read_data() as bytes.  Like
+        payload_view(), raises ValueError if the buffer is smaller than
+        the header data length.
+        '''
+        return bytes(self.payload_view())
+
+    def packet_headers(self, ch_ids=(), ring=1):
+        '''
+        Iterator of individual packet headers.  By default every header is
+        read into self.Header, so a returned header is overwritten by the
+        next one.  With ring=N, headers are read into a ring of N Header
+        objects instead, and a returned header stays valid until N-1 more
+        headers have been returned.  self.Header is always the current
+        header, for read_data().
+        '''
+        if ring < 1:
+            raise ValueError("ring must be at least 1, not %d" % ring)
+        # Pick the loop once here rather than testing ch_ids every packet
+        if len(ch_ids) == 0:
+            return self._packet_headers_all(ring)
+        return self._packet_headers_filtered(frozenset(ch_ids), ring)
+
+    # These loops run once per packet so they call the DLL directly, with
+    # the function, handle, header references and OK status in locals
+
+    def _packet_headers_all(self, ring):
+        ''' packet_headers() for all channels '''
+        ReadNextHeader = IrigDataDll.enI106Ch10ReadNextHeader
+        Handle = self._Handle
+        OK = Status.OK
+        if ring == 1:
+            PktHeader = self.Header
+            HeaderRef = ctypes.byref(PktHeader)
+            while ReadNextHeader(Handle, HeaderRef) == OK:
+                yield PktHeader
+            return
+
+        HeaderRing = [self.Header] + [Header() for _ in range(ring - 1)]
+        HeaderRefs = [ctypes.byref(PktHeader) for PktHeader in HeaderRing]
+        RingIdx = 0
+        while ReadNextHeader(Handle, HeaderRefs[RingIdx]) == OK:
+            PktHeader = HeaderRing[RingIdx]
+            self.Header = PktHeader
+            RingIdx = (RingIdx + 1) % ring
+            yield PktHeader
+
+    def _packet_headers_filtered(self, ch_ids, ring):
+        ''' packet_headers() for a frozenset of channel IDs '''
+        ReadNextHeader = IrigDataDll.enI106Ch10ReadNextHeader
+        Handle = self._Handle
+        OK = Status.OK
+        if ring == 1:
+            PktHeader = self.Header
+            HeaderRef = ctypes.byref(PktHeader)
+            while ReadNextHeader(Handle, HeaderRef) == OK:
+                if PktHeader.ChID in ch_ids:
+                    yield PktHeader
+            return
+
+        HeaderRing = [self.Header] + [Header() for _ in range(ring - 1)]
+        HeaderRefs = [ctypes.byref(PktHeader) for PktHeader in HeaderRing]
+        RingIdx = 0
+        while ReadNextHeader(Handle, HeaderRefs[RingIdx]) == OK:
+            PktHeader = HeaderRing[RingIdx]
+            self.Header = PktHeader
+            if PktHeader.ChID in ch_ids:
+                RingIdx = (RingIdx + 1) % ring
+                yield PktHeader
+
+    def header_batches(self, batch_size=65536):
+        '''
+        Iterator of (ChID, DataType) numpy array pairs, one pair per batch
+        of packet headers.  The arrays are reused between batches so a pair
+        is only valid until the next one is read.  Older DLLs without
+        enI106Ch10ScanHeaders() are handled by filling the same arrays
+        one header at a time.
+        '''
+        ch_ids = numpy.empty(batch_size, dtype=numpy.uint16)
+        data_types = numpy.empty(batch_size, dtype=numpy.uint8)
+        ScanInDll = hasattr(IrigDataDll, "enI106Ch10ScanHeaders")
+        while True:
+            if ScanInDll:
+                RetStatus, HdrCnt = I106_Ch10ScanHeaders(
+                    self._Handle, ch_ids, data_types, batch_size)
+            else:
+                RetStatus, HdrCnt = self._scan_headers(ch_ids, data_types,
+                                                       batch_size)
+            if HdrCnt > 0:
+                yield (ch_ids[:HdrCnt], data_types[:HdrCnt])
+            if RetStatus != Status.OK:
+                break
+
+    def scan_all_headers(self, ch_ids=()):
+        '''
+        Read all packet headers of the open file into a numpy array of
+        HeaderDType, optionally keeping only channel IDs in ch_ids.  The
+        headers are also kept in self.ScannedHeaders as a HeaderArrays.
+        The file is memory mapped and parsed directly rather than read
+        through the DLL, so the DLL read position is not changed.
+        The packet walk is compiled with numba when it is installed.  The
+        file is walked one window at a time while the OS is asked to read
+        the next window in the background.
+        Scanning stops at the first packet with a bad sync word or a bad
+        length, including a last packet cut short by the end of the file;
+        header checksums are not checked.  Unlike the DLL, which skips
+        ahead to the next good packet, the scan does not resync.  The
+        offset where it stopped is kept in self.ScanEndOffset, and a
+        warning is issued if that is not the end of the file.  Secondary
+        header fields are zero for packets without a secondary header.
+        '''
+        if self._Filename is None:
+            raise ValueError("No file is open to scan")
+        with open(self._Filename, 'rb') as DataFile:
+            FileSize = os.fstat(DataFile.fileno()).st_size
+            if FileSize == 0:
+                self.ScanEndOffset = 0
+                Headers = numpy.zeros(0, dtype=HeaderDType)
+                self.ScannedHeaders = HeaderArrays.from_headers(
+                    numpy.zeros(0, dtype=numpy.int64), Headers)
+                return Headers
+            DataMap = mmap.mmap(DataFile.fileno(), 0, access=mmap.ACCESS_READ)
+            # Tell the OS to read ahead, the file is read front to back
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(DataFile.fileno(), 0, 0,
+                                 os.POSIX_FADV_SEQUENTIAL)
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                DataMap.madvise(mmap.MADV_SEQUENTIAL)
+            # The map is not closed explicitly, it is released along with
+            # the last array that refers to it
+            FileBytes = numpy.frombuffer(DataMap, dtype=numpy.uint8)
+            WalkHeaders = _get_walk_headers()
+            OffsetList = []
+            Offset = 0
+            while Offset < FileSize:
+                Stop = min(Offset + _SCAN_WINDOW, FileSize)
+                if (Stop < FileSize) and hasattr(mmap, "MADV_WILLNEED"):
+                    Start = Stop - (Stop % mmap.PAGESIZE)
+                    DataMap.madvise(mmap.MADV_WILLNEED, Start,
+                                    min(_SCAN_WINDOW, FileSize - Start))
+                Offsets, Offset = WalkHeaders(FileBytes, Offset, Stop)
+                OffsetList.append(Offsets)
+                if Offset < Stop:
+                    break
+            self.ScanEndOffset = Offset
+            if Offset != FileSize:
+                warnings.warn("Header scan of '%s' stopped at offset %d, "
+                              "not at the end of the file at %d" %
+                              (self._Filename, Offset, FileSize))
+            Offsets = numpy.concatenate(OffsetList)
+            if len(ch_ids) > 0:
+                ChanIDs = (FileBytes[Offsets + 2].astype(numpy.uint16) |
+                           (FileBytes[Offsets + 3].astype(numpy.uint16) << 8))
+                Offsets = Offsets[_channel_mask(ChanIDs, ch_ids)]
+            Headers = _gather_headers(FileBytes, Offsets)
+        self.ScannedHeaders = HeaderArrays.from_headers(Offsets, Headers)
+        return Headers
+
+    def save_header_index(self, FileName):
+        ''' Save the headers from scan_all_headers() to an index file '''
+        if self.ScannedHeaders is None:
+            raise ValueError("No headers have been scanned or loaded to save")
+        self.ScannedHeaders.save(FileName)
+
+    def load_header_index(self, FileName):
+        '''
+        Load headers saved by save_header_index() into self.ScannedHeaders
+        instead of scanning the file again
+        '''
+        self.ScannedHeaders = HeaderArrays.load(FileName)
+        return self.ScannedHeaders
+
+    def header_batches_threaded(self, batch_size=65536, max_batches=4):
+        '''
+        Iterator like header_batches(), but batches are read in a background
+        thread while the caller works on earlier ones.  The DLL is loaded
+        with ctypes.CDLL, which releases the GIL during each call, so the
+        scan and the caller's numpy work really do run at the same time.
+        Older DLLs without enI106Ch10ScanHeaders() are scanned one header
+        at a time in Python, which holds the GIL, so for them the batches
+        are read in the calling thread instead.  Every batch has its own
+        arrays so they stay valid.  At most max_batches are read ahead.
+        Don't use this IO object for anything else until the iterator is
+        finished or closed.
+        '''
+        if not hasattr(IrigDataDll, "enI106Ch10ScanHeaders"):
+            for (ChIDs, DataTypes) in self.header_batches(batch_size):
+                yield (ChIDs.copy(), DataTypes.copy())
+            return
+
+        Batches = queue.Queue(max_batches)
+        Stop = threading.Event()
+        Errors = []
+
+        def read_batches():
+            try:
+                for (ChIDs, DataTypes) in self.header_batches(batch_size):
+                    if Stop.is_set():
+                        break
+                    Batches.put((ChIDs.copy(), DataTypes.copy()))
+            except Exception as e:
+                Errors.append(e)
+            finally:
+                Batches.put(None)
+
+        Reader = threading.Thread(target=read_batches)
+        Reader.daemon = True
+        Reader.start()
+        try:
+            while True:
+                Batch = Batches.get()
+                if Batch is None:
+                    break
+                yield Batch
+            if Errors:
+                raise Errors[0]
+        finally:
+            # Stop the reader, emptying the queue in case it's waiting on it
+            Stop.set()
+            while Reader.is_alive():
+                try:
+                    Batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            Reader.join()
+
+    def _scan_headers(self, ch_ids, data_types, max_hdrs):
+        ''' Python version of enI106Ch10ScanHeaders() '''
+        HdrCnt = 0
+        RetStatus = Status.OK
+        while HdrCnt < max_hdrs:
             RetStatus = self.read_next_header()
+            if RetStatus != Status.OK:
+                break
+            ch_ids[HdrCnt] = self.Header.ChID
+            data_types[HdrCnt] = self.Header.DataType
+            HdrCnt += 1
+        return (RetStatus, HdrCnt)
 
     # Other utility functions
     # -----------------------
@@ -300,6 +944,45 @@ FullDllFileName = os.path.join(FilePath, DllFileName)
 #IrigDataDll = ctypes.cdll.LoadLibrary(DllFileName)
 IrigDataDll = ctypes.cdll.LoadLibrary(FullDllFileName)
 
+# Declare argument and return types once so that ctypes converts arguments
+# (e.g. takes the address of a Header) at the call without extra objects.
+# Being a ctypes.CDLL, the GIL is released while any of these run.
+IrigDataDll.enI106Ch10Open.argtypes = [ctypes.POINTER(ctypes.c_int32),
+                                       ctypes.c_char_p, ctypes.c_int]
+IrigDataDll.enI106Ch10Close.argtypes = [ctypes.c_int32]
+IrigDataDll.enI106Ch10ReadNextHeader.argtypes = [ctypes.c_int32,
+                                                 ctypes.POINTER(Header)]
+IrigDataDll.enI106Ch10ReadPrevHeader.argtypes = [ctypes.c_int32,
+                                                 ctypes.POINTER(Header)]
+IrigDataDll.enI106Ch10ReadData.argtypes = [ctypes.c_int32, ctypes.c_ulong,
+                                           ctypes.c_void_p]
+IrigDataDll.enI106Ch10FirstMsg.argtypes = [ctypes.c_int32]
+IrigDataDll.enI106Ch10LastMsg.argtypes = [ctypes.c_int32]
+IrigDataDll.enI106Ch10SetPos.argtypes = [ctypes.c_int32, ctypes.c_int64]
+IrigDataDll.enI106Ch10GetPos.argtypes = [ctypes.c_int32,
+                                         ctypes.POINTER(ctypes.c_int64)]
+
+for DllFunc in (IrigDataDll.enI106Ch10Open, IrigDataDll.enI106Ch10Close,
+                IrigDataDll.enI106Ch10ReadNextHeader,
+                IrigDataDll.enI106Ch10ReadPrevHeader,
+                IrigDataDll.enI106Ch10ReadData,
+                IrigDataDll.enI106Ch10FirstMsg, IrigDataDll.enI106Ch10LastMsg,
+                IrigDataDll.enI106Ch10SetPos, IrigDataDll.enI106Ch10GetPos):
+    DllFunc.restype = ctypes.c_int
+
+# Older DLLs don't have the batch header reads
+if hasattr(IrigDataDll, "enI106Ch10ScanHeaders"):
+    IrigDataDll.enI106Ch10ScanHeaders.argtypes = [
+        ctypes.c_int32, ctypes.POINTER(ctypes.c_uint16),
+        ctypes.POINTER(ctypes.c_uint8), ctypes.c_ulong,
+        ctypes.POINTER(ctypes.c_ulong)]
+    IrigDataDll.enI106Ch10ScanHeaders.restype = ctypes.c_int
+if hasattr(IrigDataDll, "enI106Ch10ReadNextHeaders"):
+    IrigDataDll.enI106Ch10ReadNextHeaders.argtypes = [
+        ctypes.c_int32, ctypes.POINTER(Header), ctypes.c_ulong,
+        ctypes.POINTER(ctypes.c_ulong)]
+    IrigDataDll.enI106Ch10ReadNextHeaders.restype = ctypes.c_int
+
 # This test code just opens an IRIG file and does a histogram of the
 # data types
 
@@ -308,9 +991,6 @@ if __name__ == '__main__':
     print("IRIG 106 PacketIO")
     PktIO = IO()
 
-    # Initialize counts variables
-    Counts = {}
-
     if len(sys.argv) > 1:
         RetStatus = PktIO.open(sys.argv[1], FileMode.READ)
         if RetStatus != Status.OK:
@@ -330,16 +1010,37 @@ if __name__ == '__main__':
 #        else:
 #            Counts[PktIO.Header.DataType]  = 1
 
-    # Using Python iteration
-    for PktHdr in PktIO.packet_headers():
-#        if Counts.has_key(PktHdr.DataType):
-        if PktHdr.DataType in Counts:
-            Counts[PktHdr.DataType] += 1
-        else:
-            Counts[PktHdr.DataType] = 1
+#    Using batches of headers scanned in the DLL, with the data types
+#    collected into one buffer and counted in a single pass
+#    DataTypes = numpy.empty(65536, dtype=numpy.uint8)
+#    PktCnt = 0
+#    for ChIDs, BatchDataTypes in PktIO.header_batches():
+#        BatchCnt = len(BatchDataTypes)
+#        if PktCnt + BatchCnt > len(DataTypes):
+#            DataTypes = numpy.resize(DataTypes, 2 * (PktCnt + BatchCnt))
+#        DataTypes[PktCnt:PktCnt + BatchCnt] = BatchDataTypes
+#        PktCnt += BatchCnt
+#    Counts = numpy.bincount(DataTypes[:PktCnt], minlength=256)
+
+    if numpy is None:
+        # Using Python iteration
+        Counts = {}
+        for PktHdr in PktIO.packet_headers():
+            if PktHdr.DataType in Counts:
+                Counts[PktHdr.DataType] += 1
+            else:
+                Counts[PktHdr.DataType] = 1
+        DataTypeNums = sorted(Counts)
+        TypeNames = [DataType.TypeName(DataTypeNum)
+                     for DataTypeNum in DataTypeNums]
+    else:
+        # Using all headers from the memory mapped file at once
+        Headers = PktIO.scan_all_headers()
+        Counts = numpy.bincount(Headers['DataType'], minlength=256)
+        DataTypeNums = numpy.nonzero(Counts)[0]
+        TypeNames = DataType.TypeNameArray(DataTypeNums)
 
     PktIO.close()
 
-    for DataTypeNum in Counts:
-        print("Data Type %-24s Counts = %d" % (DataType.TypeName(DataTypeNum),
-                                               Counts[DataTypeNum]))
+    for (TypeName, DataTypeNum) in zip(TypeNames, DataTypeNums):
+        print("Data Type %-24s Counts = %d" % (TypeName, Counts[DataTypeNum]))
@@ -836,6 +836,79 @@ vCheckFillLookAheadBuffer(iHandle);
 
 
 
+/* ----------------------------------------------------------------------- */
+
+// Read a batch of headers, keeping only the channel ID and data type of
+// each one.  This lets high level language wrappers scan a whole file with
+// one call per batch instead of one call per packet.  Reading stops when
+// the output arrays are full or when a read doesn't return I106_OK.  The
+// number of headers stored is returned in pulHdrCnt along with the status
+// of the last read.
+
+EnI106Status I106_CALL_DECL
+    enI106Ch10ScanHeaders(int                iHandle,
+                          uint16_t         * puChID,
+                          uint8_t          * pubyDataType,
+                          unsigned long      ulMaxHdrs,
+                          unsigned long    * pulHdrCnt)
+    {
+    EnI106Status        enStatus = I106_OK;
+    SuI106Ch10Header    suHeader;
+
+    *pulHdrCnt = 0;
+    while (*pulHdrCnt < ulMaxHdrs)
+        {
+        enStatus = enI106Ch10ReadNextHeader(iHandle, &suHeader);
+        if (enStatus != I106_OK)
+            break;
+
+        puChID[*pulHdrCnt]       = suHeader.uChID;
+        pubyDataType[*pulHdrCnt] = suHeader.ubyDataType;
+        (*pulHdrCnt)++;
+        } // end while reading headers
+
+    return enStatus;
+    } // end enI106Ch10ScanHeaders()
+
+
+
+/* ----------------------------------------------------------------------- */
+
+// Read a batch of complete headers into a caller supplied array.  Like
+// enI106Ch10ScanHeaders() this saves a call per packet from high level
+// languages, but all header fields are returned.  Secondary header fields
+// are zeroed for packets without a secondary header.  Reading stops when
+// the array is full or when a read doesn't return I106_OK.  The number of
+// headers stored is returned in pulHdrCnt along with the status of the
+// last read.
+
+EnI106Status I106_CALL_DECL
+    enI106Ch10ReadNextHeaders(int                iHandle,
+                              SuI106Ch10Header * pasuHeader,
+                              unsigned long      ulMaxHdrs,
+                              unsigned long    * pulHdrCnt)
+    {
+    EnI106Status        enStatus = I106_OK;
+    SuI106Ch10Header  * psuHeader;
+
+    *pulHdrCnt = 0;
+    while (*pulHdrCnt < ulMaxHdrs)
+        {
+        psuHeader = &pasuHeader[*pulHdrCnt];
+        enStatus  = enI106Ch10ReadNextHeader(iHandle, psuHeader);
+        if (enStatus != I106_OK)
+            break;
+
+        if ((psuHeader->ubyPacketFlags & I106CH10_PFLAGS_SEC_HEADER) == 0)
+            memset(&psuHeader->abyTime[0], 0, SEC_HEADER_SIZE);
+        (*pulHdrCnt)++;
+        } // end while reading headers
+
+    return enStatus;
+    } // end enI106Ch10ReadNextHeaders()
+
+
+
 /* ----------------------------------------------------------------------- */
 
 EnI106Status I106_CALL_DECL 
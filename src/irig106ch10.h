@@ -348,6 +348,19 @@ EnI106Status I106_CALL_DECL
     enI106Ch10ReadNextHeaderInOrder(int                iHandle,
                                     SuI106Ch10Header * psuHeader);
 
+EnI106Status I106_CALL_DECL
+    enI106Ch10ScanHeaders(int                 iI106Ch10Handle,
+                          uint16_t          * puChID,
+                          uint8_t           * pubyDataType,
+                          unsigned long       ulMaxHdrs,
+                          unsigned long     * pulHdrCnt);
+
+EnI106Status I106_CALL_DECL
+    enI106Ch10ReadNextHeaders(int                 iI106Ch10Handle,
+                              SuI106Ch10Header  * pasuI106Hdr,
+                              unsigned long       ulMaxHdrs,
+                              unsigned long     * pulHdrCnt);
+
 EnI106Status I106_CALL_DECL
     enI106Ch10ReadPrevHeader(int                 iI106Ch10Handle,
                              SuI106Ch10Header  * psuI106Hdr);